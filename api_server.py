@@ -5,16 +5,26 @@ Provides HTTP endpoints for DataFrame processing functions
 """
 
 import os
+import mimetypes
 import uuid
 import tempfile
-from flask import Flask, request, jsonify, send_file
+import orjson
+from flask import Flask, Response, request, jsonify, send_file
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
+from pyspark import StorageLevel
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget, ValueTarget
 import sys
 import traceback
 import shutil
+import threading
 from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
 
 # Import our existing DataFrame processor functions
 sys.path.append('/app/scripts')
@@ -26,31 +36,154 @@ from custom_functions import (
     detect_anomalies, data_quality_check, pivot_dataframe, calculate_correlation
 )
 
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson, used by jsonify and request.get_json"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 # Enable CORS for all routes to allow frontend to connect
 CORS(app)
 
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200MB max file size
 app.config['UPLOAD_FOLDER'] = '/app/data/uploads'
 app.config['OUTPUT_FOLDER'] = '/app/data/outputs'
+# Let a fronting server (Apache/lighttpd X-Sendfile, nginx X-Accel-Redirect) copy downloads
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+
+# Functions exposed through /api/process
+FUNCTION_MAP = {
+    'compare_dataframes': compare_dataframes,
+    'merge_dataframes': merge_dataframes,
+    'profile_dataframe': profile_dataframe,
+    'validate_schema': validate_schema,
+    'aggregate_dataframe': aggregate_dataframe,
+    'detect_anomalies': detect_anomalies,
+    'data_quality_check': data_quality_check,
+    'pivot_dataframe': pivot_dataframe,
+    'calculate_correlation': calculate_correlation
+}
+
+ALLOWED_EXT = frozenset({'csv'})
+
+def _error_body(message):
+    """Pre-serialize a static error payload"""
+    return orjson.dumps({'success': False, 'error': message})
+
+# Error responses that never change, serialized once at import
+ERR_FILE_TOO_LARGE = _error_body('File too large. Maximum size is 200MB.')
+ERR_NO_FUNCTION = _error_body('function parameter is required')
+ERR_NO_FILES = _error_body('No files uploaded')
+ERR_NO_FILES_SELECTED = _error_body('No files selected')
+ERR_NO_VALID_FILES = _error_body('No valid CSV files uploaded')
+ERR_LOAD_FAILED = _error_body('Failed to load one or more DataFrames')
+ERR_FILE_NOT_FOUND = _error_body('File not found')
+
+def static_json_response(body, status):
+    """Wrap a pre-serialized JSON body in a fresh response"""
+    return Response(body, status=status, mimetype='application/json')
+
+# Size of the chunks read from the request body while streaming uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
 # Ensure upload and output directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-# Global Spark session
-spark = None
+# Shared Spark session, created once per worker process
+_spark_singleton = None
+_spark_lock = threading.Lock()
 
 def get_spark_session():
-    """Get or create Spark session"""
-    global spark
-    if spark is None:
-        spark = create_spark_session()
-    return spark
+    """Get or create the shared Spark session (safe under concurrent first requests)"""
+    global _spark_singleton
+    if _spark_singleton is None:
+        with _spark_lock:
+            if _spark_singleton is None:
+                _spark_singleton = create_spark_session()
+    return _spark_singleton
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'csv'}
+    return '.' in filename and filename.rpartition('.')[2].lower() in ALLOWED_EXT
+
+@lru_cache(maxsize=1024)
+def cached_secure_filename(filename):
+    """secure_filename, memoized since clients keep uploading the same names"""
+    return secure_filename(filename)
+
+class SessionFileTarget(BaseTarget):
+    """Stream every uploaded part of a file field straight into the session folder"""
+
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = Path(folder)
+        self.part_count = 0
+        self.saved_files = []
+        self.rejected_files = []
+        self._fd = None
+
+    def on_start(self):
+        self.part_count += 1
+        filename = self.multipart_filename
+        if not filename:
+            return
+        if not allowed_file(filename):
+            self.rejected_files.append(filename)
+            return
+        safe_name = cached_secure_filename(filename)
+        self._fd = open(os.fspath(self.folder / safe_name), 'wb')
+        self.saved_files.append(safe_name)
+
+    def on_data_received(self, chunk):
+        if self._fd:
+            self._fd.write(chunk)
+
+    def on_finish(self):
+        self.close()
+
+    def close(self):
+        """Close the file currently being written, if any"""
+        if self._fd:
+            self._fd.close()
+            self._fd = None
+
+def parse_upload_request(session_folder):
+    """Parse the multipart body in one pass, writing uploaded files directly to session_folder"""
+    file_target = SessionFileTarget(session_folder)
+
+    # Non-multipart bodies (e.g. url-encoded forms) cannot carry files
+    if request.mimetype != 'multipart/form-data':
+        return request.form.get('function'), request.form.get('args'), file_target
+
+    function_target = ValueTarget()
+    args_target = ValueTarget()
+    parser = StreamingFormDataParser(headers=request.headers)
+    parser.register('function', function_target)
+    parser.register('args', args_target)
+    parser.register('files', file_target)
+
+    try:
+        while True:
+            chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.data_received(chunk)
+    finally:
+        # A part interrupted by a parse error never reaches on_finish
+        file_target.close()
+
+    return function_target.value.decode('utf-8'), args_target.value.decode('utf-8'), file_target
 
 def cleanup_temp_files(file_paths):
     """Clean up temporary uploaded files"""
@@ -63,10 +196,7 @@ def cleanup_temp_files(file_paths):
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_file_too_large(error):
-    return jsonify({
-        'success': False,
-        'error': 'File too large. Maximum size is 200MB.'
-    }), 413
+    return static_json_response(ERR_FILE_TOO_LARGE, 413)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -74,7 +204,7 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'spark_session': spark is not None
+        'spark_session': _spark_singleton is not None
     })
 
 @app.route('/api/functions', methods=['GET'])
@@ -155,156 +285,101 @@ def list_functions():
 @app.route('/api/process', methods=['POST'])
 def process_dataframes():
     """Main endpoint for processing DataFrames"""
+    # Create unique session ID for this request
+    session_id = str(uuid.uuid4())
+    session_folder = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
+    os.makedirs(session_folder, exist_ok=True)
+    dataframes = None
+
     try:
-        # Get function name from form data
-        function_name = request.form.get('function')
-        if not function_name:
+        # Stream the multipart body: form values are collected, files land in session_folder
+        try:
+            function_name, args_value, upload = parse_upload_request(session_folder)
+        except ParseFailedException as e:
             return jsonify({
                 'success': False,
-                'error': 'function parameter is required'
+                'error': f'Malformed multipart request: {str(e)}'
             }), 400
 
+        # Get function name from form data
+        if not function_name:
+            return static_json_response(ERR_NO_FUNCTION, 400)
+
         # Get optional arguments
         args = []
-        if 'args' in request.form:
-            args = request.form.get('args').split(',')
+        if args_value:
+            args = args_value.split(',')
             args = [arg.strip() for arg in args if arg.strip()]
 
         # Check if files were uploaded
-        if 'files' not in request.files:
-            return jsonify({
-                'success': False,
-                'error': 'No files uploaded'
-            }), 400
+        if upload.part_count == 0:
+            return static_json_response(ERR_NO_FILES, 400)
 
-        files = request.files.getlist('files')
-        if not files or all(file.filename == '' for file in files):
-            return jsonify({
-                'success': False,
-                'error': 'No files selected'
-            }), 400
+        if not upload.saved_files and not upload.rejected_files:
+            return static_json_response(ERR_NO_FILES_SELECTED, 400)
 
         # Validate function exists
-        function_map = {
-            'compare_dataframes': compare_dataframes,
-            'merge_dataframes': merge_dataframes,
-            'profile_dataframe': profile_dataframe,
-            'validate_schema': validate_schema,
-            'aggregate_dataframe': aggregate_dataframe,
-            'detect_anomalies': detect_anomalies,
-            'data_quality_check': data_quality_check,
-            'pivot_dataframe': pivot_dataframe,
-            'calculate_correlation': calculate_correlation
-        }
-
-        if function_name not in function_map:
+        if function_name not in FUNCTION_MAP:
             return jsonify({
                 'success': False,
-                'error': f'Unknown function: {function_name}. Available functions: {list(function_map.keys())}'
+                'error': f'Unknown function: {function_name}. Available functions: {list(FUNCTION_MAP.keys())}'
             }), 400
 
-        # Create unique session ID for this request
-        session_id = str(uuid.uuid4())
-        session_folder = os.path.join(app.config['UPLOAD_FOLDER'], session_id)
-        os.makedirs(session_folder, exist_ok=True)
-
-        # Save uploaded files
-        uploaded_files = []
-        temp_file_paths = []
-
-        for file in files:
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(session_folder, filename)
-                file.save(file_path)
-                uploaded_files.append(filename)
-                temp_file_paths.append(file_path)
-            else:
-                # Clean up and return error
-                shutil.rmtree(session_folder, ignore_errors=True)
-                return jsonify({
-                    'success': False,
-                    'error': f'Invalid file: {file.filename}. Only CSV files are allowed.'
-                }), 400
-
-        if not uploaded_files:
-            shutil.rmtree(session_folder, ignore_errors=True)
+        # Validate extensions against the collected filenames
+        if upload.rejected_files:
             return jsonify({
                 'success': False,
-                'error': 'No valid CSV files uploaded'
+                'error': f'Invalid file: {upload.rejected_files[0]}. Only CSV files are allowed.'
             }), 400
 
+        uploaded_files = upload.saved_files
+        if not uploaded_files:
+            return static_json_response(ERR_NO_VALID_FILES, 400)
+
         # Get Spark session and load DataFrames
         spark_session = get_spark_session()
 
-        # Temporarily change data path for this session
-        original_data_path = "/app/data"
-        temp_data_path = session_folder
+        # Load DataFrames straight from the session folder
+        dataframes = load_dataframes(spark_session, uploaded_files, base_path=session_folder,
+                                     memoize_digests=False)
 
-        # Create temporary symlinks or copy files to expected location
-        temp_links = []
-        for filename in uploaded_files:
-            src = os.path.join(session_folder, filename)
-            dst = os.path.join(original_data_path, filename)
-            if not os.path.exists(dst):
-                os.symlink(src, dst)
-                temp_links.append(dst)
+        if dataframes is None:
+            return static_json_response(ERR_LOAD_FAILED, 400)
 
-        try:
-            # Load DataFrames using the existing function
-            dataframes = load_dataframes(spark_session, uploaded_files)
-
-            if dataframes is None:
-                return jsonify({
-                    'success': False,
-                    'error': 'Failed to load one or more DataFrames'
-                }), 400
-
-            # Execute the requested function
-            func = function_map[function_name]
-            success, message = func(dataframes, *args)
-
-            # Check if there are any output files to return
-            output_files = []
-            output_dir = "/app/data"
-            potential_outputs = ['merged_result.csv', 'anomalies_result.csv', 'quality_report.csv',
-                                'pivot_result.csv', 'correlation_result.csv', 'aggregated_result.csv']
-
-            for output_file in potential_outputs:
-                output_path = os.path.join(output_dir, output_file)
-                if os.path.exists(output_path):
-                    # Move to session-specific output folder
-                    session_output_dir = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
-                    os.makedirs(session_output_dir, exist_ok=True)
-                    new_path = os.path.join(session_output_dir, output_file)
-                    shutil.move(output_path, new_path)
-                    output_files.append({
-                        'filename': output_file,
-                        'download_url': f'/api/download/{session_id}/{output_file}'
-                    })
-
-            response = {
-                'success': success,
-                'message': message,
-                'function': function_name,
-                'files_processed': uploaded_files,
-                'session_id': session_id,
-                'output_files': output_files
-            }
+        # Cache each input once so functions that scan it repeatedly don't re-parse the CSV
+        dataframes = {name: df.persist(StorageLevel.MEMORY_AND_DISK) for name, df in dataframes.items()}
 
-            return jsonify(response)
+        # Execute the requested function, writing results into this request's own output folder
+        session_output_dir = os.path.join(app.config['OUTPUT_FOLDER'], session_id)
+        os.makedirs(session_output_dir, exist_ok=True)
+        func = FUNCTION_MAP[function_name]
+        success, message = func(dataframes, *args, output_dir=session_output_dir)
+
+        # Return whatever result files the function produced
+        output_files = [
+            {
+                'filename': output_file,
+                'download_url': f'/api/download/{session_id}/{output_file}'
+            }
+            for output_file in sorted(os.listdir(session_output_dir))
+            if os.path.isfile(os.path.join(session_output_dir, output_file))
+        ]
+        if not output_files:
+            shutil.rmtree(session_output_dir, ignore_errors=True)
+
+        response = {
+            'success': success,
+            'message': message,
+            'function': function_name,
+            'files_processed': uploaded_files,
+            'session_id': session_id,
+            'output_files': output_files
+        }
 
-        finally:
-            # Clean up temporary symlinks
-            for link in temp_links:
-                try:
-                    if os.path.islink(link):
-                        os.unlink(link)
-                except Exception as e:
-                    print(f"Warning: Could not remove symlink {link}: {e}")
+        return jsonify(response)
 
-            # Clean up uploaded files
-            shutil.rmtree(session_folder, ignore_errors=True)
+    except RequestEntityTooLarge:
+        raise
 
     except Exception as e:
         print(f"Error processing request: {e}")
@@ -314,18 +389,35 @@ def process_dataframes():
             'error': f'Internal server error: {str(e)}'
         }), 500
 
+    finally:
+        # Release cached inputs
+        if dataframes:
+            for df in dataframes.values():
+                df.unpersist(blocking=False)
+
+        # Clean up uploaded files
+        shutil.rmtree(session_folder, ignore_errors=True)
+
 @app.route('/api/download/<session_id>/<filename>', methods=['GET'])
 def download_file(session_id, filename):
     """Download output files"""
     try:
         file_path = os.path.join(app.config['OUTPUT_FOLDER'], session_id, filename)
         if not os.path.exists(file_path):
-            return jsonify({
-                'success': False,
-                'error': 'File not found'
-            }), 404
+            return static_json_response(ERR_FILE_NOT_FOUND, 404)
+
+        # nginx serves the file itself from an internal location mapped to OUTPUT_FOLDER,
+        # so hand it back an empty response without opening the file here
+        accel_prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+        if accel_prefix:
+            response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            response.headers.set('Content-Disposition', 'attachment', filename=filename)
+            response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{session_id}/{filename}"
+            return response
 
-        return send_file(file_path, as_attachment=True, download_name=filename)
+        return send_file(file_path, as_attachment=True, download_name=filename,
+                         conditional=True, etag=True,
+                         last_modified=os.path.getmtime(file_path))
 
     except Exception as e:
         return jsonify({
@@ -352,5 +444,5 @@ def cleanup_session(session_id):
             'error': f'Error cleaning up session: {str(e)}'
         }), 500
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+# Start the JVM at import so the first /api/process request doesn't pay for it
+get_spark_session()
@@ -0,0 +1,17 @@
+"""
+Gunicorn configuration for the DataFrame API
+Runs the Flask app on gevent workers so long Spark jobs don't block other requests
+"""
+
+import os
+
+# The gevent worker class monkey-patches sockets (including the Py4J socket to the JVM)
+# itself; regular file I/O is not made cooperative
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+worker_class = "gevent"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_connections = 1000
+keepalive = 5
+
+# Spark jobs can run well past gunicorn's 30s default
+timeout = 300
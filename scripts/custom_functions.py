@@ -4,11 +4,18 @@ Example custom functions that can be added to dataframe_processor.py
 Copy these functions into the PLUGGABLE FUNCTIONS section of dataframe_processor.py
 """
 
+import builtins
+from concurrent.futures import ThreadPoolExecutor
+
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
 
+from dataframe_processor import (
+    NUMERIC_TYPES, OUTPUT_DIR, WIDE_SCHEMA_COLUMNS, null_counts_vectorized, write_single_csv,
+)
+
 
-def detect_anomalies(dataframes, *args):
+def detect_anomalies(dataframes, *args, output_dir=OUTPUT_DIR):
     """Detect anomalies in numeric columns using statistical methods"""
     files = list(dataframes.keys())
     if len(files) != 1:
@@ -19,7 +26,7 @@ def detect_anomalies(dataframes, *args):
 
     # Get numeric columns
     numeric_cols = [field.name for field in df.schema.fields
-                    if field.dataType.typeName() in ['integer', 'double', 'float', 'long']]
+                    if field.dataType.typeName() in NUMERIC_TYPES]
 
     if not numeric_cols:
         return False, "No numeric columns found for anomaly detection"
@@ -44,18 +51,19 @@ def detect_anomalies(dataframes, *args):
         lower_bound = mean_val - (threshold * std_val)
         upper_bound = mean_val + (threshold * std_val)
 
-        # Find anomalies
-        anomalies = df.filter(
-            (col(target_col) < lower_bound) | (col(target_col) > upper_bound)
-        )
-
-        anomaly_count = anomalies.count()
-        total_count = df.count()
+        # Count and filter the input directly; the dispatcher has already persisted it
+        is_anomaly = (col(target_col) < lit(lower_bound)) | (col(target_col) > lit(upper_bound))
+        counts = df.agg(
+            count(lit(1)).alias("total"),
+            sum(is_anomaly.cast("int")).alias("anomalies")
+        ).collect()[0]
+        total_count = counts["total"]
+        anomaly_count = counts["anomalies"] or 0
 
         if anomaly_count > 0:
             # Save anomalies
-            output_path = "/app/data/anomalies_detected.csv"
-            anomalies.coalesce(1).write.mode('overwrite').option("header", "true").csv(output_path)
+            output_path = f"{output_dir}/anomalies_result.csv"
+            write_single_csv(df.filter(is_anomaly), output_path, row_count=anomaly_count)
 
         percentage = (anomaly_count / total_count) * 100 if total_count > 0 else 0
 
@@ -65,36 +73,64 @@ def detect_anomalies(dataframes, *args):
         return False, f"Anomaly detection failed: {e}"
 
 
-def data_quality_check(dataframes, *args):
+def _quality_metrics(df):
+    """Collect the data_quality_check metrics for one DataFrame"""
+    string_cols = [field.name for field in df.schema.fields if field.dataType.typeName() == 'string']
+
+    # Wide schemas count nulls in a separate vectorized pass to keep the aggregate small
+    wide = len(df.columns) > WIDE_SCHEMA_COLUMNS
+    null_sums = [] if wide else [sum(col(c).isNull().cast("int")).alias(f"__null_{i}")
+                                 for i, c in enumerate(df.columns)]
+
+    metrics = df.agg(
+        count(lit(1)).alias("__total_rows"),
+        countDistinct(struct(*[col(c) for c in df.columns])).alias("__distinct_rows"),
+        *null_sums,
+        *[sum(((col(c) == "") | col(c).isNull()).cast("int")).alias(f"__empty_{i}")
+          for i, c in enumerate(string_cols)]
+    ).collect()[0]
+
+    if wide:
+        null_counts = null_counts_vectorized(df)
+    else:
+        null_counts = {c: metrics[f"__null_{i}"] or 0 for i, c in enumerate(df.columns)}
+
+    return string_cols, metrics, null_counts
+
+
+def data_quality_check(dataframes, *args, output_dir=OUTPUT_DIR):
     """Comprehensive data quality assessment"""
     results = []
 
+    # Submit every file's aggregation at once so the FAIR scheduler can interleave them
+    with ThreadPoolExecutor(max_workers=builtins.max(1, len(dataframes))) as executor:
+        all_metrics = dict(zip(dataframes, executor.map(_quality_metrics, dataframes.values())))
+
     for file, df in dataframes.items():
         print(f"🔍 Quality check for {file}")
 
-        total_rows = df.count()
         total_cols = len(df.columns)
+        string_cols, metrics, null_counts = all_metrics[file]
+
+        total_rows = metrics["__total_rows"]
 
         quality_issues = []
 
         # Check for null values
-        null_counts = df.select([sum(col(c).isNull().cast("int")).alias(c) for c in df.columns]).collect()[0]
         null_cols = [(col, null_counts[col]) for col in df.columns if null_counts[col] > 0]
 
         if null_cols:
             quality_issues.append(f"Null values in {len(null_cols)} columns")
 
         # Check for duplicate rows
-        distinct_rows = df.distinct().count()
-        duplicates = total_rows - distinct_rows
+        duplicates = total_rows - metrics["__distinct_rows"]
         if duplicates > 0:
             quality_issues.append(f"{duplicates} duplicate rows")
 
         # Check for empty strings in string columns
-        string_cols = [field.name for field in df.schema.fields if field.dataType.typeName() == 'string']
         empty_string_issues = []
-        for col_name in string_cols:
-            empty_count = df.filter((col(col_name) == "") | (col(col_name).isNull())).count()
+        for i, col_name in enumerate(string_cols):
+            empty_count = metrics[f"__empty_{i}"] or 0
             if empty_count > 0:
                 empty_string_issues.append(f"{col_name}: {empty_count}")
 
@@ -103,7 +139,7 @@ def data_quality_check(dataframes, *args):
 
         # Calculate quality score
         total_cells = total_rows * total_cols
-        null_cells = sum(null_counts[col] for col in df.columns)
+        null_cells = builtins.sum(null_counts.values())
         quality_score = ((total_cells - null_cells) / total_cells) * 100 if total_cells > 0 else 0
 
         result = f"{file}: {quality_score:.1f}% quality"
@@ -120,7 +156,7 @@ def data_quality_check(dataframes, *args):
     return True, " | ".join(results)
 
 
-def pivot_dataframe(dataframes, *args):
+def pivot_dataframe(dataframes, *args, output_dir=OUTPUT_DIR):
     """Pivot DataFrame on specified columns"""
     files = list(dataframes.keys())
     if len(files) != 1:
@@ -140,19 +176,17 @@ def pivot_dataframe(dataframes, *args):
         pivoted = df.groupBy(index_col).pivot(pivot_col).sum(value_col)
 
         # Save result
-        output_path = "/app/data/pivoted_result.csv"
-        pivoted.coalesce(1).write.mode('overwrite').option("header", "true").csv(output_path)
-
-        result_count = pivoted.count()
+        output_path = f"{output_dir}/pivot_result.csv"
+        result_count = write_single_csv(pivoted, output_path)
         result_cols = len(pivoted.columns)
 
-        return True, f"Pivoted {file} -> {result_count} rows x {result_cols} cols saved to pivoted_result.csv"
+        return True, f"Pivoted {file} -> {result_count} rows x {result_cols} cols saved to pivot_result.csv"
 
     except Exception as e:
         return False, f"Pivot failed: {e}"
 
 
-def calculate_correlation(dataframes, *args):
+def calculate_correlation(dataframes, *args, output_dir=OUTPUT_DIR):
     """Calculate correlation matrix for numeric columns"""
     files = list(dataframes.keys())
     if len(files) != 1:
@@ -163,7 +197,7 @@ def calculate_correlation(dataframes, *args):
 
     # Get numeric columns
     numeric_cols = [field.name for field in df.schema.fields
-                    if field.dataType.typeName() in ['integer', 'double', 'float', 'long']]
+                    if field.dataType.typeName() in NUMERIC_TYPES]
 
     if len(numeric_cols) < 2:
         return False, "Need at least 2 numeric columns for correlation"
@@ -171,12 +205,18 @@ def calculate_correlation(dataframes, *args):
     print(f"📊 Calculating correlations for {file}: {', '.join(numeric_cols)}")
 
     try:
+        # Compute every pair in one aggregation pass; corr drops nulls per pair, like df.stat.corr
+        pairs = [(i, j) for i in range(len(numeric_cols)) for j in range(i + 1, len(numeric_cols))]
+        stats = df.agg(*[corr(numeric_cols[i], numeric_cols[j]).alias(f"__corr_{i}_{j}")
+                         for i, j in pairs]).collect()[0]
+
         correlations = []
 
-        for i, col1 in enumerate(numeric_cols):
-            for col2 in numeric_cols[i + 1:]:
-                corr_value = df.stat.corr(col1, col2)
-                correlations.append(f"{col1}-{col2}: {corr_value:.3f}")
+        for i, j in pairs:
+            # corr is NULL where df.stat.corr reports NaN (e.g. a constant column)
+            corr_value = stats[f"__corr_{i}_{j}"]
+            corr_value = float("nan") if corr_value is None else corr_value
+            correlations.append(f"{numeric_cols[i]}-{numeric_cols[j]}: {corr_value:.3f}")
 
         # Create correlation summary
         correlation_summary = "; ".join(correlations)
@@ -7,8 +7,26 @@ Usage: python dataframe_processor.py <function_name> <file1.csv> [file2.csv] [fi
 
 import sys
 import os
+import builtins
+import hashlib
+import json
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlparse
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import *
+from pyspark.sql.types import LongType, StructField, StructType
+
+try:
+    import gevent
+    from gevent.monkey import is_module_patched
+except ImportError:  # gevent is only installed for the API server
+    gevent = None
 
 
 def create_spark_session():
@@ -18,29 +36,275 @@ def create_spark_session():
         .master("local[*]")\
         .config("spark.executor.memory", "4g") \
         .config("spark.driver.memory", "4g") \
+        .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+        .config("spark.sql.execution.arrow.pyspark.fallback.enabled", "true") \
+        .config("spark.sql.execution.arrow.maxRecordsPerBatch", "50000") \
+        .config("spark.memory.offHeap.enabled", "true") \
+        .config("spark.memory.offHeap.size", "2g") \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
+        .config("spark.sql.adaptive.skewJoin.enabled", "true") \
+        .config("spark.sql.autoBroadcastJoinThreshold", "50m") \
+        .config("spark.serializer", "org.apache.spark.serializer.KryoSerializer") \
+        .config("spark.sql.shuffle.partitions", "200") \
+        .config("spark.scheduler.mode", "FAIR") \
+        .config("spark.sql.csv.parser.columnPruning.enabled", "true") \
+        .config("spark.sql.csv.filterPushdown.enabled", "true") \
+        .config("spark.driver.extraJavaOptions", "-XX:+UseG1GC -XX:+ParallelRefProcEnabled") \
         .getOrCreate()
     return spark
 
 
-def load_dataframes(spark, files):
-    """Load multiple CSV files into Spark DataFrames"""
+# Fraction of rows read to infer CSV column types; below 1.0 large files skip most
+# of the inference scan, at the risk of mistyping columns whose values vary late in the file
+SCHEMA_SAMPLING_RATIO = float(os.environ.get("SCHEMA_SAMPLING_RATIO", "1.0"))
+
+
+# Default directory for result files; the API passes a per-request directory instead
+OUTPUT_DIR = "/app/data"
+
+
+# Inferred schemas persisted between runs, keyed by file content digest
+SCHEMA_CACHE_PATH = "/tmp/schemas.json"
+# Schemas beyond this many are dropped, least recently used first
+SCHEMA_CACHE_MAX_ENTRIES = int(os.environ.get("SCHEMA_CACHE_MAX_ENTRIES", "256"))
+_schema_cache = None
+_schema_cache_lock = threading.Lock()
+
+
+def _load_schema_cache():
+    """Return the schema cache, reading it from SCHEMA_CACHE_PATH on first use"""
+    global _schema_cache
+    if _schema_cache is None:
+        try:
+            with open(SCHEMA_CACHE_PATH) as f:
+                _schema_cache = {key: StructType.fromJson(schema) for key, schema in json.load(f).items()}
+        except (OSError, ValueError):
+            _schema_cache = {}
+    return _schema_cache
+
+
+def _save_schema_cache(cache):
+    """Merge cache with the schemas other processes saved, trim it and atomically write it back"""
+    # Entries only on disk were added by other workers; keep them, ordered before ours
+    try:
+        with open(SCHEMA_CACHE_PATH) as f:
+            on_disk = json.load(f)
+    except (OSError, ValueError):
+        on_disk = {}
+    merged = {key: StructType.fromJson(schema) for key, schema in on_disk.items() if key not in cache}
+    merged.update(cache)
+    while len(merged) > SCHEMA_CACHE_MAX_ENTRIES:
+        del merged[next(iter(merged))]
+    cache.clear()
+    cache.update(merged)
+
+    tmp_path = f"{SCHEMA_CACHE_PATH}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({key: schema.jsonValue() for key, schema in cache.items()}, f)
+    os.replace(tmp_path, SCHEMA_CACHE_PATH)
+
+
+def load_dataframes(spark, files, base_path="/app/data", sampling_ratio=SCHEMA_SAMPLING_RATIO,
+                    memoize_digests=True):
+    """Load multiple CSV files from base_path into Spark DataFrames
+
+    Pass memoize_digests=False for one-off paths (e.g. per-request uploads) that
+    would never hit the per-path digest memo.
+    """
     dataframes = {}
+    with _schema_cache_lock:
+        schemas = _load_schema_cache()
     for file in files:
         try:
-            df = spark.read.csv(f"/app/data/{file}", header=True, inferSchema=True)
+            path = f"{base_path}/{file}"
+            # Reuse the schema inferred for identical content to skip the inference scan
+            key = file_fingerprint(path, memoize=memoize_digests)
+            with _schema_cache_lock:
+                schema = schemas.pop(key, None)
+                if schema is not None:
+                    # Re-insert so the most recently used schemas are evicted last
+                    schemas[key] = schema
+            if schema is not None:
+                df = spark.read.csv(path, header=True, schema=schema)
+            else:
+                df = spark.read.csv(path, header=True, inferSchema=True, samplingRatio=sampling_ratio)
+                with _schema_cache_lock:
+                    schemas[key] = df.schema
+                    _save_schema_cache(schemas)
             dataframes[file] = df
-            print(f"✅ Loaded {file}: {df.count()} rows, {len(df.columns)} columns")
+            print(f"✅ Loaded {file}: {len(df.columns)} columns")
         except Exception as e:
             print(f"❌ Failed to load {file}: {e}")
             return None
     return dataframes
 
 
+# Spark type names treated as numeric by the analysis functions
+NUMERIC_TYPES = frozenset({'integer', 'double', 'float', 'long', 'short', 'byte', 'decimal'})
+
+def estimate_size_in_bytes(df):
+    """Return Catalyst's size estimate for a DataFrame without running a job"""
+    return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+
+
+def broadcast_threshold(spark):
+    """spark.sql.autoBroadcastJoinThreshold in bytes (negative when broadcasting is disabled)"""
+    return spark._jsparkSession.sessionState().conf().autoBroadcastJoinThreshold()
+
+
+# Schemas wider than this count nulls in one Arrow pass rather than one aggregate per column
+WIDE_SCHEMA_COLUMNS = 100
+
+
+def _batch_null_counts(batches):
+    """Yield one row of per-column null counts for each Arrow batch"""
+    # Arrow validity counts match col.isNull(): NaN in a double column is not null
+    for batch in batches:
+        yield pa.RecordBatch.from_arrays(
+            [pa.array([column.null_count], pa.int64()) for column in batch.columns],
+            names=batch.schema.names)
+
+
+def null_counts_vectorized(df):
+    """Count nulls per column with mapInArrow and sum the per-batch partials on the driver"""
+    schema = StructType([StructField(c, LongType()) for c in df.columns])
+    partials = df.mapInArrow(_batch_null_counts, schema=schema).toPandas()
+    return {c: int(partials[c].sum()) for c in df.columns}
+
+
+# Parquet copies of CSV inputs, keyed by source content; kept in scratch space, not the data dir
+PARQUET_CACHE_DIR = os.environ.get("PARQUET_CACHE_DIR", "/tmp/parquet_cache")
+# Copies beyond this many are evicted, least recently used first
+PARQUET_CACHE_MAX_ENTRIES = int(os.environ.get("PARQUET_CACHE_MAX_ENTRIES", "32"))
+
+def _hash_file(path):
+    """Return the hex SHA-1 digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_file_in_thread(path):
+    """_hash_file, run on gevent's native threadpool when the process is monkey-patched
+
+    Under the gevent API workers this keeps hashing a large upload from blocking every
+    other request on the hub; elsewhere it hashes inline.
+    """
+    if gevent is not None and is_module_patched("threading"):
+        return gevent.get_hub().threadpool.apply(_hash_file, (path,))
+    return _hash_file(path)
+
+
+@lru_cache(maxsize=256)
+def _memoized_file_digest(path, size, mtime_ns):
+    """_hash_file memoized per (path, size, mtime), so an unchanged file is hashed once"""
+    return _hash_file_in_thread(path)
+
+
+def file_fingerprint(path, memoize=True):
+    """Return a SHA-1 digest of a file's contents"""
+    if not memoize:
+        return _hash_file_in_thread(path)
+    stat = os.stat(path)
+    return _memoized_file_digest(path, stat.st_size, stat.st_mtime_ns)
+
+
+def _evict_parquet_cache():
+    """Remove the least recently used Parquet copies beyond PARQUET_CACHE_MAX_ENTRIES"""
+    entries = [entry for entry in os.scandir(PARQUET_CACHE_DIR) if entry.name.endswith(".parquet")]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[PARQUET_CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def ensure_parquet(df, name):
+    """Return a CSV-backed DataFrame re-read from a Parquet copy, converting it on first use"""
+    source_files = [urlparse(f).path for f in df.inputFiles()]
+    if not source_files or not all(f.lower().endswith(".csv") for f in source_files):
+        return df
+
+    # Key on content and schema so re-uploads of the same name never read a stale copy
+    key = hashlib.sha1(df.schema.json().encode())
+    for source in sorted(source_files):
+        key.update(file_fingerprint(source).encode())
+    path = f"{PARQUET_CACHE_DIR}/{os.path.splitext(name)[0]}-{key.hexdigest()[:16]}.parquet"
+
+    if os.path.exists(path):
+        # Mark the copy as recently used so eviction keeps it
+        os.utime(path)
+    else:
+        # Write aside and rename so concurrent conversions never expose a partial copy
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            df.write.mode('overwrite').option('compression', 'snappy').parquet(tmp_path)
+            os.rename(tmp_path, path)
+        except Exception:
+            # A failed write, or losing the rename race to another request, leaves tmp_path behind
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.exists(path):
+                raise
+        _evict_parquet_cache()
+
+    return df.sparkSession.read.parquet(path)
+
+
+def count_rows(df):
+    """Count rows, reading Parquet footers instead of running a job when df is a bare Parquet scan"""
+    is_bare_scan = df._jdf.queryExecution().analyzed().getClass().getSimpleName() == "LogicalRelation"
+    files = [urlparse(f).path for f in df.inputFiles()]
+    if is_bare_scan and files and all(f.endswith(".parquet") for f in files):
+        return builtins.sum(pq.ParquetFile(f).metadata.num_rows for f in files)
+    return df.count()
+
+
+def write_single_csv(df, path, row_count=None):
+    """Write a DataFrame to one CSV file at path and return its row count
+
+    Pass row_count when the caller already knows it to skip counting again.
+    """
+    if row_count is None:
+        row_count = df.count()
+
+    # Replace results left over as Spark output directories
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+    # Always use Spark's CSV writer so types and formatting don't depend on the result size,
+    # then move its single part file into place
+    parts_dir = f"{path}.{uuid.uuid4().hex}.parts"
+    try:
+        df.coalesce(1).write.mode('overwrite').option("header", "true").csv(parts_dir)
+        part_file = next((f for f in os.listdir(parts_dir) if f.startswith("part-") and f.endswith(".csv")), None)
+        if part_file is None:
+            # Empty results may produce no part file at all
+            with open(path, "w") as f:
+                f.write(",".join(df.columns) + "\n")
+        else:
+            os.replace(os.path.join(parts_dir, part_file), path)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+
+    return row_count
+
+
 # =============================================================================
 # PLUGGABLE FUNCTIONS - Add your custom functions here
+# Each takes (dataframes, *args, output_dir) and writes any result files into output_dir
 # =============================================================================
 
-def compare_dataframes(dataframes, *args):
+def _row_digest(df):
+    """Return (row count, order-independent sum of row hashes) in a single scan"""
+    columns = [col(c) for c in df.columns]
+    # Null flags keep rows like (NULL, 1) and (1, NULL) from hashing alike
+    row_hash = xxhash64(*columns, *[c.isNull() for c in columns]).cast("decimal(20,0)")
+    digest = df.agg(count(lit(1)).alias("rows"), sum(row_hash).alias("hash_sum")).collect()[0]
+    return digest["rows"], digest["hash_sum"]
+
+
+def compare_dataframes(dataframes, *args, output_dir=OUTPUT_DIR):
     """Compare two DataFrames (default function)"""
     files = list(dataframes.keys())
     if len(files) != 2:
@@ -54,11 +318,18 @@ def compare_dataframes(dataframes, *args):
     if df1.schema != df2.schema:
         return False, "Schemas differ"
 
+    # Row counts and content digests for both frames, computed concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        (count1, digest1), (count2, digest2) = executor.map(_row_digest, (df1, df2))
+
     # Row count comparison
-    count1, count2 = df1.count(), df2.count()
     if count1 != count2:
         return False, f"Row counts differ: {count1} vs {count2}"
 
+    # Equal digests mean the same rows; only run the shuffle-heavy diff when they differ
+    if digest1 == digest2:
+        return True, "DataFrames are identical!"
+
     # Data comparison
     diff_count = df1.exceptAll(df2).count() + df2.exceptAll(df1).count()
     if diff_count > 0:
@@ -67,7 +338,7 @@ def compare_dataframes(dataframes, *args):
     return True, "DataFrames are identical!"
 
 
-def merge_dataframes(dataframes, *args):
+def merge_dataframes(dataframes, *args, output_dir=OUTPUT_DIR):
     """Merge multiple DataFrames on a common key"""
     files = list(dataframes.keys())
     if len(files) < 2:
@@ -87,32 +358,60 @@ def merge_dataframes(dataframes, *args):
         result = list(dataframes.values())[0]
         file_names = list(dataframes.keys())
 
-        # Join with remaining DataFrames
+        # Join with remaining DataFrames, broadcasting ones under the session's
+        # broadcast threshold to skip the shuffle
+        broadcast_limit = broadcast_threshold(result.sparkSession)
         for i in range(1, len(dataframes)):
             df = list(dataframes.values())[i]
-            result = result.join(df, on=join_key, how='inner')
+            is_small = 0 <= estimate_size_in_bytes(df) <= broadcast_limit
+            result = result.join(broadcast(df) if is_small else df, on=join_key, how='inner')
 
         # Save merged result
-        output_path = "/app/data/merged_result.csv"
-        result.coalesce(1).write.mode('overwrite').option("header", "true").csv(output_path)
-
-        final_count = result.count()
+        output_path = f"{output_dir}/merged_result.csv"
+        final_count = write_single_csv(result, output_path)
         return True, f"Merged {len(files)} files -> {final_count} rows saved to merged_result.csv"
 
     except Exception as e:
         return False, f"Merge failed: {e}"
 
 
-def profile_dataframe(dataframes, *args):
+def _profile_stats(df):
+    """Run the Spark jobs behind profile_dataframe for one DataFrame"""
+    if len(df.columns) > WIDE_SCHEMA_COLUMNS:
+        row_count = df.count()
+        null_counts = null_counts_vectorized(df)
+    else:
+        # Row count and per-column null counts in a single aggregation pass
+        stats = df.agg(
+            count(lit(1)).alias("__row_count"),
+            *[sum(col(c).isNull().cast("int")).alias(f"__null_{i}") for i, c in enumerate(df.columns)]
+        ).collect()[0]
+        row_count = stats["__row_count"]
+        null_counts = {c: stats[f"__null_{i}"] or 0 for i, c in enumerate(df.columns)}
+
+    # Numeric column stats
+    numeric_cols = [field.name for field in df.schema.fields if
+                    field.dataType.typeName() in NUMERIC_TYPES]
+    if numeric_cols:
+        df.select(numeric_cols).summary().collect()
+
+    return row_count, null_counts, numeric_cols
+
+
+def profile_dataframe(dataframes, *args, output_dir=OUTPUT_DIR):
     """Generate profile/summary statistics for DataFrames"""
     print(f"📊 Profiling {len(dataframes)} DataFrames...")
 
+    # Submit every file's jobs at once so the FAIR scheduler can interleave them
+    with ThreadPoolExecutor(max_workers=builtins.max(1, len(dataframes))) as executor:
+        profiles = dict(zip(dataframes, executor.map(_profile_stats, dataframes.values())))
+
     results = []
     for file, df in dataframes.items():
         print(f"\n📄 Profile for {file}:")
+        row_count, null_counts, numeric_cols = profiles[file]
 
         # Basic stats
-        row_count = df.count()
         col_count = len(df.columns)
         print(f"   Rows: {row_count:,}, Columns: {col_count}")
 
@@ -120,16 +419,11 @@ def profile_dataframe(dataframes, *args):
         print(f"   Columns: {', '.join(df.columns)}")
 
         # Null counts
-        null_counts = df.select([sum(col(c).isNull().cast("int")).alias(c) for c in df.columns]).collect()[0]
         null_info = {col: null_counts[col] for col in df.columns if null_counts[col] > 0}
         if null_info:
             print(f"   Nulls: {null_info}")
 
-        # Numeric column stats
-        numeric_cols = [field.name for field in df.schema.fields if
-                        field.dataType.typeName() in ['integer', 'double', 'float', 'long']]
         if numeric_cols:
-            stats = df.select(numeric_cols).summary().collect()
             print(f"   Numeric summaries available for: {', '.join(numeric_cols)}")
 
         results.append(f"{file}: {row_count} rows x {col_count} cols")
@@ -137,7 +431,7 @@ def profile_dataframe(dataframes, *args):
     return True, f"Profiled {len(dataframes)} files: " + ", ".join(results)
 
 
-def validate_schema(dataframes, *args):
+def validate_schema(dataframes, *args, output_dir=OUTPUT_DIR):
     """Validate that all DataFrames have the same schema"""
     files = list(dataframes.keys())
     if len(files) < 2:
@@ -158,7 +452,7 @@ def validate_schema(dataframes, *args):
     return True, f"All {len(files)} files have identical schemas"
 
 
-def aggregate_dataframe(dataframes, *args):
+def aggregate_dataframe(dataframes, *args, output_dir=OUTPUT_DIR):
     """Aggregate DataFrame by specified columns"""
     files = list(dataframes.keys())
     if len(files) != 1:
@@ -192,10 +486,8 @@ def aggregate_dataframe(dataframes, *args):
             return False, f"Unsupported aggregation function: {agg_func}"
 
         # Save result
-        output_path = "/app/data/aggregated_result.csv"
-        result.coalesce(1).write.mode('overwrite').option("header", "true").csv(output_path)
-
-        result_count = result.count()
+        output_path = f"{output_dir}/aggregated_result.csv"
+        result_count = write_single_csv(result, output_path)
         return True, f"Aggregated {file} -> {result_count} groups saved to aggregated_result.csv"
 
     except Exception as e:
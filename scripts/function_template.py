@@ -6,24 +6,89 @@ Copy this template and modify it for your specific needs.
 Then add your function to the FUNCTIONS dictionary in dataframe_processor.py
 """
 
-from pyspark.sql.functions import *
-from pyspark.sql.types import *
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import (
+    approx_count_distinct, array, avg as F_avg, broadcast, col, count as F_count,
+    desc, explode, lit, rand, sum as F_sum, when,
+)
+
+from dataframe_processor import (
+    OUTPUT_DIR, broadcast_threshold, count_rows, ensure_parquet, estimate_size_in_bytes,
+)
+
+
+# Rows per output file when spark.sql.files.maxRecordsPerFile is left at 0 (unlimited)
+DEFAULT_RECORDS_PER_FILE = 1_000_000
+
+
+def output_partitions(spark, row_count):
+    """Number of output files needed to keep each under maxRecordsPerFile rows"""
+    max_records = int(spark.conf.get("spark.sql.files.maxRecordsPerFile", "0"))
+    return max(1, math.ceil(row_count / (max_records or DEFAULT_RECORDS_PER_FILE)))
+
+
+# Join keys with more rows than this on the left side are spread over SKEW_SALT_BUCKETS
+SKEW_MIN_ROWS = 1_000_000
+SKEW_SALT_BUCKETS = 8
+# Fraction of the left input sampled to estimate heavy-hitter key counts
+SKEW_SAMPLE_FRACTION = 0.01
+
+
+def salted_join(left, right, key):
+    """Inner join on key, salting heavy-hitter keys of left so no single task gets all their rows"""
+    # Approximate the top keys from a sample rather than counting every row of left
+    top = left.sample(fraction=SKEW_SAMPLE_FRACTION, seed=42) \
+        .groupBy(key).count().orderBy(desc("count")).limit(5).collect()
+    hot_keys = [row[key] for row in top if row["count"] > SKEW_MIN_ROWS * SKEW_SAMPLE_FRACTION]
+    if not hot_keys:
+        # Hash-partition both sides on the key so they're co-partitioned for the join
+        return left.repartition(key).join(right.repartition(key), on=key, how='inner')
+
+    is_hot = col(key).isin(hot_keys)
+    left = left.withColumn(
+        "__salt", when(is_hot, (rand() * SKEW_SALT_BUCKETS).cast("int")).otherwise(lit(0)))
+    # Replicate hot-key rows on the right once per salt value so every bucket finds its match
+    right = right.withColumn(
+        "__salt", explode(when(is_hot, array(*[lit(i) for i in range(SKEW_SALT_BUCKETS)]))
+                          .otherwise(array(lit(0)))))
+    left = left.repartition(key, "__salt")
+    right = right.repartition(key, "__salt")
+    return left.join(right, on=[key, "__salt"], how='inner').drop("__salt")
+
+
+# Results are written partitioned by the join key only when it has at most this many values
+MAX_KEY_PARTITIONS = 100
+
+# Aggregate column builders for aggregation_function, keyed by agg_type
+AGG_FACTORIES = {
+    'sum': lambda c: F_sum(c).alias(f'sum_{c}'),
+    'avg': lambda c: F_avg(c).alias(f'avg_{c}'),
+    'count': lambda c: F_count(c).alias(f'count_{c}'),
+}
 
 
-def template_function(dataframes, *args):
+def template_function(dataframes, *args, output_dir=OUTPUT_DIR):
     """
     Template function for custom DataFrame operations
 
+    Prefer built-in column expressions. When custom Python logic is needed, write
+    it as a @pandas_udf (vectorized over Arrow batches) rather than a row-at-a-time
+    @udf - see the example in step 4.
+
     Args:
         dataframes: Dictionary of {filename: spark_dataframe}
         *args: Additional arguments passed from command line
+        output_dir: Directory to write result files into
 
     Returns:
         tuple: (success: bool, message: str)
     """
 
     # 1. VALIDATE INPUTS
-    files = list(dataframes.keys())
+    files = list(dataframes)
 
     # Example: Check number of files
     if len(files) != 2:  # Adjust based on your needs
@@ -37,6 +102,7 @@ def template_function(dataframes, *args):
     # Get specific DataFrames
     df1 = dataframes[files[0]]
     df2 = dataframes[files[1]]
+    spark = df1.sparkSession
 
     # Get arguments
     required_arg = args[0]
@@ -46,40 +112,92 @@ def template_function(dataframes, *args):
     print(f"🔍 Processing {files[0]} and {files[1]} with arg: {required_arg}")
 
     # Example: Check if required columns exist
-    required_columns = ['id', 'value']  # Adjust for your use case
+    required_columns = frozenset(['id', 'value'])  # Adjust for your use case
     for file, df in dataframes.items():
-        missing_cols = [col for col in required_columns if col not in df.columns]
+        missing_cols = required_columns.difference(df.columns)
         if missing_cols:
-            return False, f"Missing columns in {file}: {missing_cols}"
+            return False, f"Missing columns in {file}: {sorted(missing_cols)}"
+
+    # Example: Check the optional threshold is numeric
+    if optional_arg != "default_value":
+        try:
+            threshold = float(optional_arg) / 2
+        except ValueError:
+            return False, f"Threshold must be numeric, got '{optional_arg}'"
+
+    # Example: Check the join column exists in both files
+    if required_arg not in df1.columns or required_arg not in df2.columns:
+        return False, f"Join column '{required_arg}' not found in both files"
 
     # 4. PROCESS DATA
     try:
         # Example processing logic - replace with your actual logic
 
-        # Simple example: Join DataFrames
-        if required_arg in df1.columns and required_arg in df2.columns:
-            result = df1.join(df2, on=required_arg, how='inner')
-        else:
-            return False, f"Join column '{required_arg}' not found in both files"
-
-        # Example: Add computed column
-        result = result.withColumn("computed_value",
-                                   col("value") * lit(2))  # Replace with your logic
+        # Query a columnar Parquet copy of each validated CSV input instead of re-parsing the CSV
+        df1 = ensure_parquet(df1, files[0])
+        df2 = ensure_parquet(df2, files[1])
 
-        # Example: Filter data
+        # Example: Filter data before the join so fewer rows are shuffled.
+        # Null keys never match an inner join, and computed_value > x is value > x / 2
+        # (computed_value comes from the left input's value, so only df1 is thresholded)
+        df1 = df1.filter(col(required_arg).isNotNull())
+        df2 = df2.filter(col(required_arg).isNotNull())
         if optional_arg != "default_value":
-            result = result.filter(col("computed_value") > lit(optional_arg))
-
-        # 5. SAVE RESULTS (optional)
-        output_path = "/app/data/template_result.csv"
-        result.coalesce(1).write.mode('overwrite').option("header", "true").csv(output_path)
-
-        # 6. CALCULATE METRICS
-        result_count = result.count()
-        result_cols = len(result.columns)
+            df1 = df1.filter(col("value") > lit(threshold))
+
+        # Example: Suffix the right side's shared non-key columns (e.g. value -> value_right)
+        # so they stay unambiguous after the join and in the written output
+        shared_cols = (set(df1.columns) & set(df2.columns)) - {required_arg}
+        df2 = df2.select(*[col(c).alias(f"{c}_right") if c in shared_cols else col(c)
+                           for c in df2.columns])
+
+        # Simple example: Join DataFrames, broadcasting the smaller side when it fits
+        # under the broadcast threshold so the larger side isn't shuffled
+        broadcast_limit = broadcast_threshold(spark)
+        size1, size2 = estimate_size_in_bytes(df1), estimate_size_in_bytes(df2)
+        if broadcast_limit >= 0 and size2 <= broadcast_limit and size2 <= size1:
+            result = df1.join(broadcast(df2), on=required_arg, how='inner')
+        elif broadcast_limit >= 0 and size1 <= broadcast_limit:
+            result = broadcast(df1).join(df2, on=required_arg, how='inner')
+        else:
+            # Shuffled join: salt skewed keys so one task doesn't receive every hot row
+            result = salted_join(df1, df2, required_arg)
+
+        # Example: Add computed column in one projection
+        result = result.selectExpr("*", "value * 2 AS computed_value")  # Replace with your logic
+
+        # Example: Custom Python logic as a vectorized pandas UDF instead of @udf
+        # import pandas as pd
+        # from pyspark.sql.functions import pandas_udf
+        #
+        # @pandas_udf("double")
+        # def compute(v: pd.Series) -> pd.Series:
+        #     return v * 2
+        #
+        # result = result.withColumn("computed_value", compute("value"))
+
+        # 5. CALCULATE METRICS (persist first so the write reuses the computed rows)
+        result = result.persist(StorageLevel.MEMORY_AND_DISK)
+        try:
+            stats = result.agg(F_count(lit(1)).alias("rows"),
+                               approx_count_distinct(required_arg).alias("keys")).collect()[0]
+            result_count = stats["rows"]
+            result_cols = len(result.columns)
+
+            # 6. SAVE RESULTS (optional)
+            output_path = f"{output_dir}/template_result.parquet"
+            writer = result.coalesce(output_partitions(spark, result_count)) \
+                .write.mode('overwrite').option("compression", "snappy")
+            # Partition by the join key so later joins/filters on it can prune files,
+            # unless that would create a directory per row
+            if stats["keys"] <= MAX_KEY_PARTITIONS:
+                writer = writer.partitionBy(required_arg)
+            writer.parquet(output_path)
+        finally:
+            result.unpersist()
 
         # 7. RETURN SUCCESS
-        return True, f"Processed {len(files)} files -> {result_count} rows x {result_cols} cols saved to template_result.csv"
+        return True, f"Processed {len(files)} files -> {result_count} rows x {result_cols} cols saved to template_result.parquet"
 
     except Exception as e:
         # 8. HANDLE ERRORS
@@ -88,79 +206,94 @@ def template_function(dataframes, *args):
 
 # Example of different function patterns:
 
-def single_file_function(dataframes, *args):
+def single_file_function(dataframes, *args, output_dir=OUTPUT_DIR):
     """Function that works on a single file"""
-    files = list(dataframes.keys())
-    if len(files) != 1:
+    if len(dataframes) != 1:
         return False, "This function requires exactly 1 file"
 
-    df = list(dataframes.values())[0]
-    file = files[0]
+    file, df = next(iter(dataframes.items()))
+    df = ensure_parquet(df, file)
 
     # Your single-file processing logic here
     try:
-        # Example: Count rows
-        row_count = df.count()
+        # Example: Count rows (from Parquet metadata when possible)
+        row_count = count_rows(df)
         return True, f"{file} has {row_count} rows"
     except Exception as e:
         return False, f"Failed to process {file}: {e}"
 
 
-def multi_file_function(dataframes, *args):
+def multi_file_function(dataframes, *args, output_dir=OUTPUT_DIR):
     """Function that works on multiple files"""
-    files = list(dataframes.keys())
-    if len(files) < 2:
+    if len(dataframes) < 2:
         return False, "This function requires at least 2 files"
 
+    dataframes = {file: ensure_parquet(df, file) for file, df in dataframes.items()}
+
     try:
+        # Submit every file's job at once so total latency is the slowest count, not the sum
+        with ThreadPoolExecutor(max_workers=len(dataframes)) as executor:
+            counts = dict(zip(dataframes, executor.map(count_rows, dataframes.values())))
+
         results = []
-        for file, df in dataframes.items():
+        for file in dataframes:
             # Process each DataFrame
-            count = df.count()
-            results.append(f"{file}: {count} rows")
+            results.append(f"{file}: {counts[file]} rows")
 
         return True, " | ".join(results)
     except Exception as e:
         return False, f"Multi-file processing failed: {e}"
 
 
-def aggregation_function(dataframes, *args):
+def aggregation_function(dataframes, *args, output_dir=OUTPUT_DIR):
     """Function that performs aggregation"""
-    files = list(dataframes.keys())
-    if len(files) != 1:
+    if len(dataframes) != 1:
         return False, "Aggregation requires exactly 1 file"
 
     if len(args) < 2:
-        return False, "Usage: aggregate_function <file.csv> <group_col> <agg_col> [agg_type]"
+        return False, "Usage: aggregate_function <file.csv> <group_col> <agg_col> [agg_type[,agg_type...]]"
 
-    df = list(dataframes.values())[0]
+    file, df = next(iter(dataframes.items()))
+    spark = df.sparkSession
     group_col = args[0]
     agg_col = args[1]
-    agg_type = args[2] if len(args) > 2 else 'sum'
+    # Agg types may arrive comma-joined (CLI) or already split into separate args (API);
+    # repeats are dropped so each output column is produced once
+    agg_types = list(dict.fromkeys(t.strip() for t in ",".join(args[2:]).split(",") if t.strip())) or ['sum']
 
     try:
         # Validate columns exist
-        if group_col not in df.columns:
+        cols_set = set(df.columns)
+        if group_col not in cols_set:
             return False, f"Group column '{group_col}' not found"
-        if agg_col not in df.columns:
+        if agg_col not in cols_set:
             return False, f"Aggregation column '{agg_col}' not found"
 
-        # Perform aggregation
-        if agg_type == 'sum':
-            result = df.groupBy(group_col).agg(sum(agg_col).alias(f'sum_{agg_col}'))
-        elif agg_type == 'avg':
-            result = df.groupBy(group_col).agg(avg(agg_col).alias(f'avg_{agg_col}'))
-        elif agg_type == 'count':
-            result = df.groupBy(group_col).count()
-        else:
-            return False, f"Unsupported aggregation type: {agg_type}"
-
-        # Save result
-        output_path = "/app/data/aggregation_result.csv"
-        result.coalesce(1).write.mode('overwrite').option("header", "true").csv(output_path)
-
-        result_count = result.count()
-        return True, f"Aggregated by '{group_col}' -> {result_count} groups saved"
+        unsupported = [t for t in agg_types if t not in AGG_FACTORIES]
+        if unsupported:
+            return False, f"Unsupported aggregation type: {', '.join(unsupported)}"
+
+        # Aggregate a Parquet copy of the validated input instead of re-parsing the CSV
+        df = ensure_parquet(df, file)
+
+        # Perform every requested aggregation in a single groupBy pass
+        result = df.groupBy(group_col).agg(*[AGG_FACTORIES[t](agg_col) for t in agg_types])
+
+        # Count first on the persisted result, then size the output files from it
+        result = result.persist(StorageLevel.MEMORY_AND_DISK)
+        try:
+            result_count = result.count()
+
+            # Save result range-partitioned and sorted by the group column, so each file
+            # covers a narrow group_col range and filters on it skip files by their
+            # Parquet min/max stats (partitionBy would write one single-row file per group)
+            output_path = f"{output_dir}/aggregation_result.parquet"
+            result.repartitionByRange(output_partitions(spark, result_count), group_col) \
+                .sortWithinPartitions(group_col) \
+                .write.mode('overwrite').option("compression", "snappy").parquet(output_path)
+        finally:
+            result.unpersist()
+        return True, f"Aggregated by '{group_col}' -> {result_count} groups saved to aggregation_result.parquet"
 
     except Exception as e:
         return False, f"Aggregation failed: {e}"
@@ -3,15 +3,28 @@
 Health check script for all services
 """
 
-import requests
+import os
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Data files expected under /app/data (comma-separated)
+HEALTHCHECK_FILES = os.environ.get(
+    "HEALTHCHECK_FILES", "sample_data1.csv,sample_data2.csv,sample_data3.csv")
+
+# Shared session keeps the Spark Master connection alive across checks;
+# created on first use so the other checks don't pay for importing requests
+_session = None
 
 
 def check_spark():
     """Check Spark Master health"""
+    global _session
     try:
-        response = requests.get('http://spark-master:8080', timeout=5)
+        if _session is None:
+            import requests
+            _session = requests.Session()
+        response = _session.get('http://spark-master:8080', timeout=5)
         return response.status_code == 200
     except:
         return False
@@ -28,8 +41,7 @@ def check_python_env():
 
 def check_data_files():
     """Check if sample data files exist"""
-    import os
-    required_files = ['sample_data1.csv', 'sample_data2.csv', 'sample_data3.csv']
+    required_files = [f.strip() for f in HEALTHCHECK_FILES.split(",") if f.strip()]
     return all(os.path.exists(f'/app/data/{f}') for f in required_files)
 
 
@@ -45,20 +57,22 @@ def main():
 
     print("🔍 Running health checks...")
 
-    for name, check_func in checks:
-        try:
-            if check_func():
-                print(f"✅ {name}: OK")
-            else:
-                print(f"❌ {name}: FAILED")
+    # Run checks concurrently so the Spark HTTP timeout doesn't hold up the others
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        futures = {executor.submit(check_func): name for name, check_func in checks}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                if future.result():
+                    print(f"✅ {name}: OK")
+                else:
+                    print(f"❌ {name}: FAILED")
+                    all_healthy = False
+            except Exception as e:
+                print(f"❌ {name}: ERROR - {str(e)}")
                 all_healthy = False
-        except Exception as e:
-            print(f"❌ {name}: ERROR - {str(e)}")
-            all_healthy = False
 
-    if __name__ == '__main__':
-        import sys
-        sys.exit(0 if all_healthy else 1)
+    return 0 if all_healthy else 1
 
 
 if __name__ == "__main__":
@@ -5,17 +5,67 @@ Tests all endpoints and functions with proper error handling
 """
 
 import requests
+import io
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
 
 API_BASE_URL = "http://localhost:8651"
 DATA_DIR = "/home/toavina/PycharmProjects/dataframe-tester/data"
 
+# Shared session so parallel test requests reuse pooled keep-alive connections
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
+@lru_cache(maxsize=None)
+def sample_bytes(name):
+    """Read a sample CSV from disk once; later calls reuse the bytes"""
+    with open(f"{DATA_DIR}/{name}", "rb") as f:
+        return f.read()
+
+def upload(name):
+    """Build a multipart file tuple over a fresh in-memory buffer of a sample CSV"""
+    return (name, io.BytesIO(sample_bytes(name)), "text/csv")
+
+def _run(func_name, description, file_names, args=()):
+    """Run one /api/process call and return (func_name, success, status_code, log_lines)"""
+    log = [f"\n  Testing {description} ({func_name})..."]
+    try:
+        files = [("files", upload(name)) for name in file_names]
+        data = {"function": func_name}
+        if args:
+            data["args"] = ",".join(args)
+        response = session.post(f"{API_BASE_URL}/api/process", files=files, data=data)
+
+        result = response.json()
+        success = result.get("success", False)
+        message = result.get("message", "No message")
+        log.append(f"    Status: {response.status_code}, Success: {success}")
+        log.append(f"    Message: {message}")
+        return func_name, success, response.status_code, log
+
+    except Exception as e:
+        log.append(f"    Error: {e}")
+        return func_name, False, 500, log
+
+def _run_all(tasks):
+    """Run tasks in parallel, then print their logs in order and return the result tuples"""
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        outcomes = list(executor.map(lambda task: _run(*task), tasks))
+
+    results = []
+    for func_name, success, status_code, log in outcomes:
+        print("\n".join(log))
+        results.append((func_name, success, status_code))
+    return results
+
 def test_health_check():
     """Test the health check endpoint"""
     print("🔍 Testing Health Check...")
-    response = requests.get(f"{API_BASE_URL}/health")
+    response = session.get(f"{API_BASE_URL}/health")
     print(f"Status: {response.status_code}")
     print(f"Response: {json.dumps(response.json(), indent=2)}")
     return response.status_code == 200
@@ -23,7 +73,7 @@ def test_health_check():
 def test_list_functions():
     """Test the functions listing endpoint"""
     print("\n📋 Testing Functions List...")
-    response = requests.get(f"{API_BASE_URL}/api/functions")
+    response = session.get(f"{API_BASE_URL}/api/functions")
     print(f"Status: {response.status_code}")
     data = response.json()
     print(f"Available functions: {len(data.get('functions', {}))}")
@@ -41,28 +91,9 @@ def test_single_file_functions():
         ("calculate_correlation", "Correlation calculation")
     ]
 
-    results = []
-    for func_name, description in single_file_tests:
-        print(f"\n  Testing {description} ({func_name})...")
-        try:
-            with open(f"{DATA_DIR}/sample_data1.csv", "rb") as f:
-                files = {"files": f}
-                data = {"function": func_name}
-                response = requests.post(f"{API_BASE_URL}/api/process", files=files, data=data)
-
-            result = response.json()
-            success = result.get("success", False)
-            message = result.get("message", "No message")
-            print(f"    Status: {response.status_code}, Success: {success}")
-            print(f"    Message: {message}")
-
-            results.append((func_name, success, response.status_code))
-
-        except Exception as e:
-            print(f"    Error: {e}")
-            results.append((func_name, False, 500))
-
-    return results
+    tasks = [(func_name, description, ["sample_data1.csv"])
+             for func_name, description in single_file_tests]
+    return _run_all(tasks)
 
 def test_multi_file_functions():
     """Test functions that work with multiple files"""
@@ -74,37 +105,14 @@ def test_multi_file_functions():
         ("merge_dataframes", "DataFrame merging", ["id"])  # with args
     ]
 
-    results = []
+    tasks = []
     for test_data in multi_file_tests:
         func_name = test_data[0]
         description = test_data[1]
         args = test_data[2] if len(test_data) > 2 else []
+        tasks.append((func_name, description, ["sample_data1.csv", "sample_data2.csv"], args))
 
-        print(f"\n  Testing {description} ({func_name})...")
-        try:
-            with open(f"{DATA_DIR}/sample_data1.csv", "rb") as f1, \
-                 open(f"{DATA_DIR}/sample_data2.csv", "rb") as f2:
-
-                files = [("files", f1), ("files", f2)]
-                data = {"function": func_name}
-                if args:
-                    data["args"] = ",".join(args)
-
-                response = requests.post(f"{API_BASE_URL}/api/process", files=files, data=data)
-
-            result = response.json()
-            success = result.get("success", False)
-            message = result.get("message", "No message")
-            print(f"    Status: {response.status_code}, Success: {success}")
-            print(f"    Message: {message}")
-
-            results.append((func_name, success, response.status_code))
-
-        except Exception as e:
-            print(f"    Error: {e}")
-            results.append((func_name, False, 500))
-
-    return results
+    return _run_all(tasks)
 
 def test_error_handling():
     """Test various error conditions"""
@@ -113,10 +121,9 @@ def test_error_handling():
     # Test invalid function
     print("  Testing invalid function name...")
     try:
-        with open(f"{DATA_DIR}/sample_data1.csv", "rb") as f:
-            files = {"files": f}
-            data = {"function": "invalid_function"}
-            response = requests.post(f"{API_BASE_URL}/api/process", files=files, data=data)
+        files = {"files": upload("sample_data1.csv")}
+        data = {"function": "invalid_function"}
+        response = session.post(f"{API_BASE_URL}/api/process", files=files, data=data)
 
         result = response.json()
         print(f"    Status: {response.status_code}")
@@ -128,7 +135,7 @@ def test_error_handling():
     print("  Testing request with no files...")
     try:
         data = {"function": "profile_dataframe"}
-        response = requests.post(f"{API_BASE_URL}/api/process", data=data)
+        response = session.post(f"{API_BASE_URL}/api/process", data=data)
         result = response.json()
         print(f"    Status: {response.status_code}")
         print(f"    Error message: {result.get('error', 'No error message')}")
@@ -145,10 +152,9 @@ def test_concurrent_requests():
 
     def make_request(request_id):
         try:
-            with open(f"{DATA_DIR}/sample_data1.csv", "rb") as f:
-                files = {"files": f}
-                data = {"function": "profile_dataframe"}
-                response = requests.post(f"{API_BASE_URL}/api/process", files=files, data=data)
+            files = {"files": upload("sample_data1.csv")}
+            data = {"function": "profile_dataframe"}
+            response = session.post(f"{API_BASE_URL}/api/process", files=files, data=data)
 
             result = response.json()
             results.append((request_id, result.get("success", False), response.status_code))